@@ -18,7 +18,7 @@ d. ID: Sequence of DNS query starting from 00
 
 # Importing Libraries
 from scapy.all import PcapReader, DNS, UDP
-import socket, time
+import socket, time, gzip, json, base64, hashlib
 
 # Globals
 SERVER_IP = "127.0.0.1"
@@ -26,17 +26,56 @@ SERVER_PORT = 23
 PCAP_FILE = "9.pcap"
 LOCAL = False
 OUTPUT_FILE = "client_ans.txt"
+INDEX_FILE = "dns_index.json.gz"   # built by A2/pcap_index.py, PCAP_FILE is dissected if missing
+INDEX_VERSION = 2                  # must match A2/pcap_index.py
 
 def make_header(seq):
     ''' return current time + seq number in bits '''
     ts = time.strftime("%H%M%S", time.localtime())
     return f"{ts}{seq:02d}".encode()
 
+def indexed_queries():
+    ''' DNS queries of PCAP_FILE from the index, None if its content is not indexed '''
+    # the index only holds port 53 queries, LOCAL needs the pcap
+    if LOCAL:
+        return None
+    try:
+        with gzip.open(INDEX_FILE, "rt") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+
+    # the capture is matched by content, so a copied PCAP_FILE is found too
+    h = hashlib.sha256()
+    with open(PCAP_FILE, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    found = [e for e in index.get("captures", {}).values() if e["sha256"] == h.hexdigest()]
+    if not found:
+        return None
+    # same qnames and raw DNS messages, in the same order, as pcap_queries()
+    return [(q[0], base64.b64decode(q[4])) for q in found[0]["queries"]]
+
+def pcap_queries():
+    ''' DNS queries of PCAP_FILE by dissecting it '''
+    for p in PcapReader(PCAP_FILE):
+        # Getting only DNS query and skipping mDNS 
+        if p.haslayer(DNS) and p[DNS].qr == 0 and p[UDP].dport == 53 and p[DNS].qd and not LOCAL:  
+            qname = p[DNS].qd.qname.decode()                                        
+            
+            # if qname.endswith(".local.") and not LOCAL:   # other logic for skipping mDNS Queries
+            #     continue
+            yield qname, bytes(p[DNS])
+
 def main():
     ''' send DNS packets with header to server '''
 
-    # reading pcap file
-    pkts = PcapReader(PCAP_FILE)
+    # reading the index, or the pcap file if it is not indexed
+    queries = indexed_queries()
+    if queries is None:
+        queries = pcap_queries()
 
     # creating a UDP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -48,33 +87,26 @@ def main():
 
         seq = 0
 
-        for p in pkts:
-            # Getting only DNS query and skipping mDNS 
-            if p.haslayer(DNS) and p[DNS].qr == 0 and p[UDP].dport == 53 and not LOCAL:  
-                qname = p[DNS].qd.qname.decode()                                        
-                
-                # if qname.endswith(".local.") and not LOCAL:   # other logic for skipping mDNS Queries
-                #     continue
-
-                # making header
-                header = make_header(seq)
-                payload = header + bytes(p[DNS])
-                sock.sendto(payload, (SERVER_IP, SERVER_PORT))
-
-                # receiving response from server
-                try:
-                    data, _ = sock.recvfrom(2048)
-                    # resolved = data.decode()
-                    resolved = DNS(data).an[0].rdata
-                    
-                except:
-                    resolved = "No Reply"
+        for qname, query in queries:
+            # making header
+            header = make_header(seq)
+            payload = header + query
+            sock.sendto(payload, (SERVER_IP, SERVER_PORT))
+
+            # receiving response from server
+            try:
+                data, _ = sock.recvfrom(2048)
+                # resolved = data.decode()
+                resolved = DNS(data).an[0].rdata
                 
-                # logging to file
-                line = f"{header.decode()} | {qname} | {resolved}"
-                out.write(line + "\n")
+            except:
+                resolved = "No Reply"
+            
+            # logging to file
+            line = f"{header.decode()} | {qname} | {resolved}"
+            out.write(line + "\n")
 
-                seq += 1
+            seq += 1
         out.write("-------------------------------------------------------\n")
         
 
@@ -0,0 +1,214 @@
+'''
+OVERVIEW
+--------------------------------------------------------------------------------
+Extracts the DNS queries (qname, qtype, timestamp, source) from many PCAPs in
+parallel and writes them to one compact index file. A capture is re-processed
+only when its content (SHA-256) changed since the last run; size and
+modification time are checked first so unchanged files are not re-hashed.
+
+Usage:
+    python3 pcap_index.py 1.pcap 2.pcap ... [-o dns_index.json.gz] [-j 4]
+
+--------------------------------------------------------------------------------
+INDEX FORMAT (gzipped JSON)
+{
+    "version": 2,
+    "captures": {
+        "<absolute path>": {
+            "size": ..., "mtime": ..., "sha256": ...,
+            "queries": [[qname, qtype, timestamp, source, dns], ...]
+        }
+    }
+}
+Every query is kept, in capture order, with its DNS message as base64 (dns)
+so that the A1 client can replay the capture exactly. Repeated names are
+only merged when a domain list is read (domains()); gzip keeps the
+repetition cheap on disk.
+--------------------------------------------------------------------------------
+'''
+
+import argparse
+import base64
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os
+
+INDEX_FILE = "dns_index.json.gz"
+INDEX_VERSION = 2
+
+
+def capture_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def extract_queries(path):
+    ''' dissect one capture, return (path, sha256, queries) '''
+    # imported here so that loading the index does not need scapy
+    from scapy.all import PcapReader, DNS, UDP, IP, IPv6
+
+    sha = file_sha256(path)
+    queries = []
+    with PcapReader(path) as pkts:
+        for p in pkts:
+            # Getting only DNS query and skipping mDNS (same rule as A1 client)
+            if not (p.haslayer(DNS) and p.haslayer(UDP) and p[DNS].qr == 0 and p[UDP].dport == 53):
+                continue
+            if not p[DNS].qd:   # no question (qd is a list in scapy >= 2.6)
+                continue
+            qname = p[DNS].qd.qname.decode(errors="ignore")
+            qtype = int(p[DNS].qd.qtype)
+            if p.haslayer(IP):
+                src = p[IP].src
+            elif p.haslayer(IPv6):
+                src = p[IPv6].src
+            else:
+                src = ""
+            raw = base64.b64encode(bytes(p[DNS])).decode()
+            queries.append([qname, qtype, float(p.time), src, raw])
+
+    return path, sha, queries
+
+
+def load_index(index_file=INDEX_FILE):
+    ''' return the captures dict of the index, empty if missing or stale format '''
+    try:
+        with gzip.open(index_file, "rt") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index.get("captures", {})
+
+
+def save_index(captures, index_file=INDEX_FILE):
+    tmp = index_file + ".tmp"
+    with gzip.open(tmp, "wt") as f:
+        json.dump({"version": INDEX_VERSION, "captures": captures}, f, separators=(",", ":"))
+    os.replace(tmp, index_file)
+
+
+def find_capture(captures, name=None, sha256=None):
+    '''
+    entry for a capture file name (without extension) and/or content hash.
+    Copies with the same content count as one; None (with a warning) if
+    different captures share the name.
+    '''
+    found = [(path, entry) for path, entry in captures.items()
+             if (name is None or capture_name(path) == name)
+             and (sha256 is None or entry["sha256"] == sha256)]
+    if not found:
+        return None
+    if len({entry["sha256"] for _, entry in found}) > 1:
+        print(f"pcap_index: {name or sha256} is ambiguous ({', '.join(p for p, _ in found)}), not using the index")
+        return None
+    return found[0][1]
+
+
+def domains(entry):
+    ''' ordered unique query names of one capture entry, without the trailing dot '''
+    out = []
+    seen = set()
+    for query in entry["queries"]:
+        d = query[0].rstrip(".")
+        if d and d not in seen:
+            seen.add(d)
+            out.append(d)
+    return out
+
+
+def entry_is_current(path, entry):
+    ''' True if the file at path still has the content recorded in entry '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if (entry["size"], entry["mtime"]) == (st.st_size, st.st_mtime):
+        return True
+    if entry["size"] == st.st_size and entry["sha256"] == file_sha256(path):
+        # touched or copied, same content
+        entry["mtime"] = st.st_mtime
+        return True
+    return False
+
+
+def build_index(paths, index_file=INDEX_FILE, workers=None):
+    ''' (re)process the changed captures in a process pool and update the index '''
+    captures = load_index(index_file)
+    state = lambda: {k: (e["size"], e["mtime"], e["sha256"]) for k, e in captures.items()}
+    before = state()
+
+    todo = []
+    for path in paths:
+        key = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+            entry = captures.get(key)
+            if entry and entry_is_current(path, entry):
+                print(f"{path}: unchanged, {len(entry['queries'])} queries")
+                continue
+            # same content indexed under another path (moved or copied capture)
+            sha = file_sha256(path)
+            same = [e for e in captures.values() if e["size"] == st.st_size and e["sha256"] == sha]
+        except OSError as e:
+            print(f"{path}: skipped, {e}")
+            continue
+        if same:
+            captures[key] = dict(same[0], mtime=st.st_mtime)
+            print(f"{path}: same content as an indexed capture, {len(same[0]['queries'])} queries")
+            continue
+        todo.append(path)
+
+    failed = []
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(extract_queries, path): path for path in todo}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    _, sha, queries = future.result()
+                    st = os.stat(path)
+                except Exception as e:
+                    # e.g. truncated or corrupt capture, keep the others
+                    failed.append(path)
+                    print(f"{path}: failed, {e!r}")
+                    continue
+                captures[os.path.abspath(path)] = {
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "sha256": sha,
+                    "queries": queries
+                }
+                print(f"{path}: extracted {len(queries)} queries")
+
+    # drop captures that were removed, moved away or replaced since they were indexed
+    for key in list(captures):
+        if not entry_is_current(key, captures[key]):
+            print(f"{key}: no longer on disk or changed, dropped from the index")
+            del captures[key]
+
+    if state() != before:
+        save_index(captures, index_file)
+    if failed:
+        print(f"{len(failed)} capture(s) failed: {', '.join(failed)}")
+
+    return captures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a DNS query index from PCAP files")
+    parser.add_argument("pcaps", nargs="+")
+    parser.add_argument("-o", "--output", default=INDEX_FILE)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+    build_index(args.pcaps, args.output, args.jobs)
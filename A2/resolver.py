@@ -4,10 +4,14 @@ import threading
 import struct
 import logging
 import json
+import os
 from collections import namedtuple
 from dns import message, rdatatype, exception
 import dns.name
+import dns.flags
+import dns.rcode
 import dns.rdatatype
+import dns.rrset
 import dns.exception
 import random  
 import concurrent.futures
@@ -34,6 +38,25 @@ LOGFILE = "resolver_log_recursive.jsonl"
 ENABLE_CACHE = False
 PORT = 53534
 MAX_WORKERS = 100  
+MAX_CNAME_CHAIN = 8 # max CNAME links followed for one query
+
+# Local zones, checked before the cache. Longest matching suffix wins.
+#   static:   answer authoritatively from "records", NXDOMAIN for other names in the zone
+#   nxdomain: blocked / private suffix, always NXDOMAIN
+#   forward:  send the query (RD=1) to the given "servers"
+# More entries can be given in LOCAL_ZONE_FILE (a JSON list of the same dicts).
+LOCAL_ZONE_FILE = "local_zones.json"
+LOCAL_ZONE_TYPES = ("static", "nxdomain", "forward")
+LOCAL_NEGATIVE_TTL = 300 # SOA minimum for local NXDOMAIN / NODATA answers
+LOCAL_ZONES = [
+    {"zone": "local.", "type": "nxdomain"},             # mDNS names
+    {"zone": "localhost.", "type": "static", "records": [
+        {"name": "localhost.", "type": "A", "ttl": 3600, "data": ["127.0.0.1"]},
+        {"name": "localhost.", "type": "AAAA", "ttl": 3600, "data": ["::1"]},
+    ]},
+    {"zone": "10.in-addr.arpa.", "type": "nxdomain"},   # RFC 1918 reverse zones
+    {"zone": "168.192.in-addr.arpa.", "type": "nxdomain"},
+] + [{"zone": f"{i}.172.in-addr.arpa.", "type": "nxdomain"} for i in range(16, 32)]
 MODE = "ITERATIVE" # Recursive or Iterative
 #MODE = "RECURSIVE" (part E)
 
@@ -79,6 +102,148 @@ def cache_set(qname, qtype_str, answer_rrsets, ttl):
         cache[key] = CacheEntry(answer_rrsets=answer_rrsets, expiry=expiry)
 
 
+class ZoneTrie:
+    """
+    Suffix trie over reversed labels ("www.example.com." -> com, example, www).
+    Lookup walks at most one node per label of the name, whatever the table size.
+    """
+    def __init__(self):
+        self.children = {}
+        self.rule = None
+
+    def insert(self, zone, rule):
+        node = self
+        for label in reversed(dns.name.from_text(zone).labels[:-1]):
+            node = node.children.setdefault(label.lower(), ZoneTrie())
+        node.rule = rule
+
+    def lookup(self, qname):
+        """ rule of the longest zone that is a suffix of qname, or None """
+        node = self
+        best = self.rule
+        for label in reversed(dns.name.from_text(str(qname)).labels[:-1]):
+            node = node.children.get(label.lower())
+            if node is None:
+                break
+            if node.rule is not None:
+                best = node.rule
+        return best
+
+
+def local_soa(zone_name):
+    """ synthesized SOA for negative answers from a local zone (RFC 2308) """
+    rname = "hostmaster." + str(zone_name) if zone_name != dns.name.root else "hostmaster."
+    return dns.rrset.from_text(zone_name, LOCAL_NEGATIVE_TTL, "IN", "SOA",
+                               f"{zone_name} {rname} 1 3600 600 86400 {LOCAL_NEGATIVE_TTL}")
+
+
+def load_local_zones(zones):
+    """ build the ZoneTrie, raising ValueError for a malformed zone entry """
+    trie = ZoneTrie()
+    for zone in zones:
+        if not isinstance(zone, dict) or "zone" not in zone or zone.get("type") not in LOCAL_ZONE_TYPES:
+            raise ValueError(f"local zone {zone}: needs 'zone' and a 'type' out of {LOCAL_ZONE_TYPES}")
+        try:
+            zone_name = dns.name.from_text(zone["zone"])
+        except Exception as e:
+            raise ValueError(f"local zone {zone['zone']!r}: bad zone name: {e!r}")
+        rule = {"zone": str(zone_name), "type": zone["type"], "soa": local_soa(zone_name)}
+
+        if zone["type"] == "static":
+            # (owner, type) -> rrset, plus the set of owner names that exist
+            rule["records"] = {}
+            rule["names"] = set()
+            for rec in zone.get("records", []):
+                try:
+                    rrset = dns.rrset.from_text(rec["name"], rec.get("ttl", 300), "IN", rec["type"], *rec["data"])
+                except Exception as e:
+                    raise ValueError(f"local zone {zone['zone']}: bad record {rec}: {e!r}")
+                if not rrset.name.is_subdomain(zone_name):
+                    raise ValueError(f"local zone {zone['zone']}: record {rec['name']} is outside the zone")
+                rule["records"][(str(rrset.name).lower(), rec["type"].upper())] = rrset
+                # the owner and every name between it and the apex exist
+                # (empty non-terminals answer NODATA, not NXDOMAIN)
+                name = rrset.name
+                while True:
+                    rule["names"].add(str(name).lower())
+                    if name == zone_name:
+                        break
+                    name = name.parent()
+
+        elif zone["type"] == "forward":
+            if not zone.get("servers"):
+                raise ValueError(f"local zone {zone['zone']}: forward zone without 'servers'")
+            rule["servers"] = list(zone["servers"])
+
+        trie.insert(zone["zone"], rule)
+    return trie
+
+
+if os.path.exists(LOCAL_ZONE_FILE):
+    with open(LOCAL_ZONE_FILE) as f:
+        extra_zones = json.load(f)
+    if not isinstance(extra_zones, list) or not all(isinstance(z, dict) for z in extra_zones):
+        raise ValueError(f"{LOCAL_ZONE_FILE}: expected a JSON list of zone objects")
+    LOCAL_ZONES = LOCAL_ZONES + extra_zones
+local_zones = load_local_zones(LOCAL_ZONES)
+
+
+def local_resolve(qname, qtype_str):
+    """
+    Answer from the local zone table.
+    Returns None if no local zone matches, else
+    (answer_rrsets, authority_rrsets, rcode, trace, total_time, disposition).
+    Negative answers carry the zone's SOA in the authority section.
+    """
+    rule = local_zones.lookup(qname)
+    if rule is None:
+        return None
+
+    start = time.time()
+    name = str(qname).lower()
+    rec = {"step": "Local", "zone": rule["zone"], "type": rule["type"]}
+
+    if rule["type"] == "nxdomain":
+        return [], [rule["soa"]], dns.rcode.NXDOMAIN, [rec], time.time() - start, "BLOCKED"
+
+    if rule["type"] == "static":
+        # follow CNAMEs as long as their target is answered by this same zone
+        answer = []
+        visited = {name}
+        while True:
+            rrset = rule["records"].get((name, qtype_str))
+            if rrset is not None:
+                answer.append(rrset)
+                return answer, [], dns.rcode.NOERROR, [rec], time.time() - start, "LOCAL"
+            cname = rule["records"].get((name, "CNAME"))
+            if cname is None:
+                break
+            answer.append(cname)
+            target = cname[0].target
+            if str(target).lower() in visited or local_zones.lookup(target) is not rule:
+                # loop, or the client has to resolve the target elsewhere
+                return answer, [], dns.rcode.NOERROR, [rec], time.time() - start, "LOCAL"
+            name = str(target).lower()
+            visited.add(name)
+        if name in rule["names"]:
+            return answer, [rule["soa"]], dns.rcode.NOERROR, [rec], time.time() - start, "LOCAL"   # NODATA
+        return answer, [rule["soa"]], dns.rcode.NXDOMAIN, [rec], time.time() - start, "LOCAL"
+
+    # forward
+    trace = [rec]
+    for server in rule["servers"]:
+        resp, rtt = query_server(qname, qtype_str, server, recursion_desired=True)
+        trace.append({
+            "server_ip": server,
+            "rtt": rtt if rtt is not None else -1,
+            "step": "Forward",
+            "response": [str(rr) for rr in resp.answer] if resp is not None else "NO RESPONSE"
+        })
+        if resp is not None:
+            return list(resp.answer), list(resp.authority), resp.rcode(), trace, time.time() - start, "FORWARD"
+    return None, [], dns.rcode.SERVFAIL, trace, time.time() - start, "FAILED"
+
+
 def log_record(record: dict):
     # write a json-line
     logger.info(json.dumps(record))
@@ -124,21 +289,150 @@ def query_server(qname, qtype, server_ip, timeout=2.0, recursion_desired=False):
 
 
 
+def closest_cached_servers(qname):
+    """
+    Walk up from qname looking for the deepest delegation we have cached
+    (NS set + A glue for at least one of its nameservers).
+    Returns (server_ips, zone). Falls back to the root servers.
+    """
+    name = dns.name.from_text(str(qname))
+    while name != dns.name.root:
+        ns_rrsets, _ = cache_get(name, "NS")
+        if ns_rrsets:
+            ips = []
+            for rrset in ns_rrsets:
+                for item in rrset:
+                    a_rrsets, _ = cache_get(item.target, "A")
+                    for a_rrset in a_rrsets or []:
+                        ips.extend(a.to_text() for a in a_rrset)
+            if ips:
+                return ips, str(name)
+        name = name.parent()
+    return list(ROOT_SERVERS), "."
+
+
+def follow_chain(qname, qtype_str, rrsets):
+    """
+    Follow qname through the CNAME links in rrsets.
+    Returns (links, final, last_name): the CNAME rrsets on the chain, the
+    qtype records at its end ([] if missing) and the last name reached.
+    Stops at a repeated name or after MAX_CNAME_CHAIN links.
+    """
+    links = []
+    name = qname
+    visited = {str(name).lower()}
+    while True:
+        final = [rr for rr in rrsets
+                 if rr.name == name and dns.rdatatype.to_text(rr.rdtype) == qtype_str]
+        if final:
+            return links, final, name
+        cname = [rr for rr in rrsets
+                 if rr.name == name and rr.rdtype == rdatatype.CNAME]
+        if not cname:
+            return links, [], name
+        links.append(cname[0])
+        name = cname[0][0].target
+        if str(name).lower() in visited or len(links) > MAX_CNAME_CHAIN:
+            return links, [], name
+        visited.add(str(name).lower())
+
+
 def iterative_resolve(qname, qtype_str):
     """
-    Perform iterative resolution; return final answer (or None) and a trace list.
+    CNAME-aware iterative resolution; return final answer (or None) and a trace list.
+    Each CNAME link is cached under its own owner name, and the target of a
+    link is resolved starting from the deepest cached delegation.
     Trace element: dict with server_ip, step, response_summary, rtt
     """
-    # cache check
-    cached_rrsets, status = cache_get(qname, qtype_str)
-    if cached_rrsets:
-        return cached_rrsets, True, [{"cache_status": "HIT"}], 0.0, "CACHE"
+    # ANY and other meta-types: no chasing, return the answer as the server gave it
+    if dns.rdatatype.is_metatype(dns.rdatatype.from_text(qtype_str)):
+        return resolve_from_servers(qname, qtype_str)
 
     trace = []
     total_start = time.time()
+    chain = []                      # CNAME rrsets collected so far
+    current = dns.name.from_text(str(qname))
+    seen = {str(current).lower()}   # loop detection
+    all_cached = True
 
-    # start with root servers
-    servers_to_try = list(ROOT_SERVERS)
+    while True:
+        # cache check: final answer for the current name
+        cached_rrsets, status = cache_get(current, qtype_str)
+        if cached_rrsets:
+            trace.append({"step": "Cache", "name": str(current), "status": "HIT"})
+            if all_cached:
+                return chain + cached_rrsets, True, [{"cache_status": "HIT"}] + trace, 0.0, "CACHE"
+            total_time = time.time() - total_start
+            return chain + cached_rrsets, True, trace, total_time, "ANSWER"
+
+        # cache check: a cached CNAME link for the current name
+        target_rrsets = None
+        if qtype_str != "CNAME":
+            cname_rrsets, _ = cache_get(current, "CNAME")
+            if cname_rrsets:
+                trace.append({"step": "Cache/CNAME", "name": str(current), "status": "HIT"})
+                target_rrsets = cname_rrsets
+
+        if target_rrsets is None:
+            # nothing cached, ask the servers (starting at the closest cached zone cut)
+            all_cached = False
+            answer, success, sub_trace, _, disposition = resolve_from_servers(current, qtype_str)
+            trace = trace + sub_trace
+            if not success:
+                total_time = time.time() - total_start
+                if chain and disposition in ("NXDOMAIN", "NODATA"):
+                    # the target has no such records: the CNAME links are the answer
+                    return chain, True, trace, total_time, disposition
+                return None, False, trace, total_time, disposition
+            target_rrsets = answer
+
+        # walk the answer: collect the CNAME links until we reach the final records
+        links, final, name = follow_chain(current, qtype_str, target_rrsets)
+        for link in links:
+            chain.append(link)
+            target = str(link[0].target).lower()
+            if target in seen:
+                total_time = time.time() - total_start
+                return None, False, trace, total_time, "CNAMELOOP"
+            if len(chain) > MAX_CNAME_CHAIN:
+                total_time = time.time() - total_start
+                return None, False, trace, total_time, "CNAMELIMIT"
+            seen.add(target)
+
+        if final:
+            total_time = time.time() - total_start
+            if all_cached:
+                return chain + final, True, [{"cache_status": "HIT"}] + trace, 0.0, "CACHE"
+            return chain + final, True, trace, total_time, "ANSWER"
+
+        if name == current:
+            # answer neither has the records nor a CNAME for this name
+            total_time = time.time() - total_start
+            return None, False, trace, total_time, "FAILED"
+
+        # chase the target of the last link
+        current = name
+
+
+def resolve_from_servers(qname, qtype_str):
+    """
+    Iteratively query servers for exactly qname/qtype (no CNAME chasing),
+    starting from the deepest cached delegation.
+    Returns the answer as soon as a server gives one. For concrete types only
+    the rrsets on the CNAME chain from qname that are inside the answering
+    server's zone (bailiwick) are returned and cached.
+    """
+    trace = []
+    total_start = time.time()
+    qname = dns.name.from_text(str(qname))
+    is_meta = dns.rdatatype.is_metatype(dns.rdatatype.from_text(qtype_str))
+
+    # start with the closest cached servers, root servers as fallback
+    servers_to_try, zone = closest_cached_servers(qname)
+    server_zone = {ip: dns.name.from_text(zone) for ip in servers_to_try}  # bailiwick per server
+    if zone != ".":
+        trace.append({"step": "Cache/Delegation", "zone": zone, "servers": list(servers_to_try)})
+        servers_to_try = servers_to_try + list(ROOT_SERVERS)
     
     # Keep track of servers we've already queried for this name
     # to avoid simple loops.
@@ -157,6 +451,7 @@ def iterative_resolve(qname, qtype_str):
         queried_servers.add(server)
 
         resp, rtt = query_server(qname, qtype_str, server)
+        bailiwick = server_zone.get(server, dns.name.root)
         
         rec = {
             "server_ip": server,
@@ -177,17 +472,24 @@ def iterative_resolve(qname, qtype_str):
             rec["step"] = "Authoritative/Answer"
             trace.append(rec)
 
-            # --- MINOR FIX (TTL logic) ---
-            # Find the minimum TTL in the answer set to use for caching
-            min_ttl = None
-            for rrset in resp.answer:
-                if min_ttl is None or rrset.ttl < min_ttl:
-                    min_ttl = rrset.ttl
-            ttl_to_cache = min_ttl if min_ttl is not None else 30 # Default 30s
-            
-            cache_set(qname, qtype_str, resp.answer, ttl_to_cache)
+            # Only trust the chain from qname, and only inside the server's zone
+            if is_meta:
+                trusted = [rr for rr in resp.answer if rr.name == qname]
+            else:
+                links, final, _ = follow_chain(qname, qtype_str, resp.answer)
+                trusted = []
+                for rr in links + final:
+                    if not rr.name.is_subdomain(bailiwick):
+                        break # rest of the chain is chased from its own zone
+                    trusted.append(rr)
+
+            # Cache each trusted rrset (CNAME links included) under its own owner and TTL
+            for rrset in trusted:
+                cache_set(rrset.name, rdatatype.to_text(rrset.rdtype), [rrset], rrset.ttl)
             total_time = time.time() - total_start
-            return resp.answer, True, trace, total_time, "ANSWER"
+            if is_meta:
+                return resp.answer, True, trace, total_time, "ANSWER"
+            return trusted, True, trace, total_time, "ANSWER"
         
         else:
             # No answer: This is a referral
@@ -199,14 +501,29 @@ def iterative_resolve(qname, qtype_str):
             }
             trace.append(rec)
 
+            # ...unless it is a negative answer (SOA of a zone above qname)
+            soa = [rr for rr in auth if rr.rdtype == rdatatype.SOA
+                   and qname.is_subdomain(rr.name) and rr.name.is_subdomain(bailiwick)]
+            if soa or resp.rcode() == dns.rcode.NXDOMAIN:
+                total_time = time.time() - total_start
+                if resp.rcode() == dns.rcode.NXDOMAIN:
+                    return None, False, trace, total_time, "NXDOMAIN"
+                return None, False, trace, total_time, "NODATA"
+
+            # zone the referral points to; only accepted if it is between
+            # the server's zone and qname
+            next_zone = bailiwick
             if auth:
                 for rrset in auth:
-                    if rrset.rdtype == rdatatype.NS:
+                    if (rrset.rdtype == rdatatype.NS and qname.is_subdomain(rrset.name)
+                            and rrset.name.is_subdomain(bailiwick)):
                         cache_set(rrset.name, "NS", [rrset], rrset.ttl)
+                        next_zone = rrset.name
             if addl:
                 for rrset in addl:
-                    # Cache glue records
-                    if rrset.rdtype == rdatatype.A or rrset.rdtype == rdatatype.AAAA:
+                    # Cache glue records (in-bailiwick only)
+                    if ((rrset.rdtype == rdatatype.A or rrset.rdtype == rdatatype.AAAA)
+                            and rrset.name.is_subdomain(bailiwick)):
                         cache_set(rrset.name, rdatatype.to_text(rrset.rdtype), [rrset], rrset.ttl)
 
             # Pick IPs from additional (glue) as next servers
@@ -220,6 +537,9 @@ def iterative_resolve(qname, qtype_str):
                         except Exception:
                             pass
             
+            for ip in next_servers:
+                server_zone.setdefault(ip, next_zone)
+
             if next_servers:
                 # We have glue! Add these servers to the front of the list.
                 servers_to_try = list(set(next_servers)) + servers_to_try # Use set to de-dupe
@@ -253,6 +573,8 @@ def iterative_resolve(qname, qtype_str):
                         break
                 
                 if derived_ips:
+                    for ip in derived_ips:
+                        server_zone.setdefault(ip, next_zone)
                     servers_to_try = list(set(derived_ips)) + servers_to_try
                     continue
                 else:
@@ -342,10 +664,21 @@ def handle_query(data, addr, sock):
         "query_name": str(qname),
         "query_type": qtype_str
     }
-    if (MODE == "ITERATIVE"):
+    # local zones / overrides first, they never reach the cache or the root servers
+    rcode = None
+    authority_rrsets = []
+    local = local_resolve(qname, qtype_str)
+    if local is not None:
+        answer_rrsets, authority_rrsets, rcode, trace, total_time, disposition = local
+        success = rcode != dns.rcode.SERVFAIL
+    elif (MODE == "ITERATIVE"):
         answer_rrsets, success, trace, total_time, disposition = iterative_resolve(qname, qtype_str)
     elif (MODE == "RECURSIVE"):
         answer_rrsets, success, trace, total_time, disposition = recursive_resolve(qname, qtype_str)
+
+    if local is None and success and disposition in ("NXDOMAIN", "NODATA"):
+        # CNAME chain whose target is missing or has no records of this type
+        rcode = dns.rcode.NXDOMAIN if disposition == "NXDOMAIN" else dns.rcode.NOERROR
     
     servers_contacted = [t.get("server_ip") for t in trace if "server_ip" in t]
 
@@ -353,7 +686,7 @@ def handle_query(data, addr, sock):
 
     record = {
         **log_base,
-        "resolution_mode": "Iterative",
+        "resolution_mode": "Local" if local is not None else "Iterative",
         "servers_contacted": list(set(servers_contacted)), # de-dupe
         "trace": trace,
         "total_time": total_time,
@@ -365,7 +698,16 @@ def handle_query(data, addr, sock):
 
     # Craft response
     resp_msg = message.make_response(req)
-    if answer_rrsets:
+    if rcode is not None:
+        # local answer, authoritative unless forwarded
+        if disposition in ("LOCAL", "BLOCKED"):
+            resp_msg.flags |= dns.flags.AA
+        resp_msg.set_rcode(rcode)
+        for rrset in answer_rrsets or []:
+            resp_msg.answer.append(rrset)
+        for rrset in authority_rrsets:
+            resp_msg.authority.append(rrset)
+    elif answer_rrsets:
         for rrset in answer_rrsets:
             try:
                 resp_msg.answer.append(rrset)
@@ -8,10 +8,23 @@ from scapy.utils import RawPcapReader
 from scapy.layers.dns import DNS, DNSQR
 from scapy.layers.l2 import Ether
 import re
+import math
 import time
 import os
 
+import pcap_index
+
 DNSRESOLVER = "DEFAULT" #  "CUSTOM or DEFAULT"
+TOPOLOGY = "ASSIGNMENT" # "ASSIGNMENT or SCALABLE" (load testing)
+
+# ScalableTopo parameters
+NUM_HOSTS = 32
+FANOUT = 8          # hosts per edge switch
+LINK_BW = 100       # Mbps
+LINK_DELAY = '2ms'
+LINK_LOSS = 0       # percent
+
+INDEX_FILE = pcap_index.INDEX_FILE # built by pcap_index.py, PCAP_*_domains.txt used if missing
 
 class AssignmentTopo(Topo):
     def build(self):
@@ -37,12 +50,54 @@ class AssignmentTopo(Topo):
         self.addLink(s3, s4, bw=100, delay='10ms')
 
 
+class ScalableTopo(Topo):
+    """
+    n_hosts clients spread over edge switches (fanout hosts each), all edge
+    switches hang off one core switch, which also connects the dns node.
+    """
+    def build(self, n_hosts=NUM_HOSTS, fanout=FANOUT, bw=LINK_BW, delay=LINK_DELAY, loss=LINK_LOSS):
+        if fanout <= 0:
+            raise ValueError(f"fanout must be at least 1, got {fanout}")
+        link_opts = dict(bw=bw, delay=delay)
+        if loss:
+            link_opts['loss'] = loss
+
+        core = self.addSwitch('s1')
+        # dns host keeps the same address as in AssignmentTopo, clients start after it
+        dns = self.addHost('dns', ip='10.0.0.5')
+        self.addLink(dns, core, bw=bw, delay='1ms')
+
+        edge = None
+        for i in range(n_hosts):
+            if i % fanout == 0:
+                edge = self.addSwitch(f's{i // fanout + 2}')
+                self.addLink(edge, core, **link_opts)
+            ip = f'10.0.{(i + 10) // 250}.{(i + 10) % 250 + 1}'
+            host = self.addHost(f'h{i + 1}', ip=ip)
+            self.addLink(host, edge, **link_opts)
+
+
+def load_domains(domain_file, captures=None):
+    """
+    Domain list for 'PCAP_x_Hx_domains': taken from the capture 'PCAP_x_Hx'
+    in the DNS index if exactly one indexed file has that name, else from
+    the text file.
+    """
+    if captures is None:
+        captures = pcap_index.load_index(INDEX_FILE)
+    name = domain_file[:-len("_domains")] if domain_file.endswith("_domains") else domain_file
+    entry = pcap_index.find_capture(captures, name=name)
+    if entry is not None:
+        return pcap_index.domains(entry)
+    with open(f"{domain_file}.txt","r") as f:
+        return [d.strip() for d in f if d.strip()]
+
+
 def dns_analysis(net, host_domain_mapping):    
+    captures = pcap_index.load_index(INDEX_FILE)
     for host_name, domain_file in host_domain_mapping.items():
         host = net.get(host_name)
-        domains = []
-        with open(f"{domain_file}.txt","r") as f:
-            domains = f.readlines()
+        domains = load_domains(domain_file, captures)
         
         if not domains:
             print(f"No domains to test for {host_name}. Skipping.")
@@ -93,7 +148,104 @@ def dns_analysis(net, host_domain_mapping):
         print(f"    - Average Throughput:    {avg_throughput:.2f} queries/sec")
 
 
+def percentile(values, p):
+    """ nearest-rank percentile of a list of numbers """
+    if not values:
+        return 0
+    values = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[min(k, len(values) - 1)]
+
+
+def dig_command(domain_file, resolver_ip):
+    """ dig in batch mode (-f) over a whole domain list """
+    if (DNSRESOLVER == "DEFAULT"):
+        return ['dig', '-f', domain_file, f'@{resolver_ip}']
+    return ['dig', '-f', domain_file, f'@{resolver_ip}', '-p', '53534', '+tries=1', '+retry=0']
+
+
+def parse_dig_batch(output):
+    """
+    Split dig -f output into one block per query (each starts with the
+    '; <<>> DiG' banner). Returns (success_count, latencies of NOERROR queries).
+    """
+    success_count = 0
+    latencies = []
+    for block in re.split(r"^; <<>> DiG", output, flags=re.M)[1:]:
+        status_match = re.search(r"status: (\w+)", block)
+        if status_match and status_match.group(1) == "NOERROR":
+            success_count += 1
+            latency_match = re.search(r"Query time: (\d+) msec", block)
+            if latency_match:
+                latencies.append(int(latency_match.group(1)))
+    return success_count, latencies
+
+
+def concurrent_dns_analysis(net, host_domain_mapping, resolver_ip):
+    """
+    Run the query workload on all hosts at the same time and aggregate
+    throughput and latency percentiles over all of them.
+    """
+    procs = {}
+    results = {}
+
+    def wait_host(host_name, proc, start):
+        output, _ = proc.communicate()
+        results[host_name] = (output.decode(errors='ignore'), time.time() - start)
+
+    # dig -f needs a file per host
+    captures = pcap_index.load_index(INDEX_FILE)
+    n_queries = {}
+    for host_name, domain_file in host_domain_mapping.items():
+        domains = load_domains(domain_file, captures)
+        n_queries[host_name] = len(domains)
+        with open(f"/tmp/{host_name}_domains.txt", "w") as f:
+            f.write("\n".join(domains) + "\n")
+
+    overall_start = time.time()
+    waiters = []
+    for host_name in host_domain_mapping:
+        host = net.get(host_name)
+        procs[host_name] = host.popen(dig_command(f"/tmp/{host_name}_domains.txt", resolver_ip),
+                                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        t = threading.Thread(target=wait_host, args=(host_name, procs[host_name], time.time()))
+        t.start()
+        waiters.append(t)
+
+    print(f"\nStarted DNS lookups on {len(procs)} hosts concurrently...")
+    for t in waiters:
+        t.join()
+    overall_time = time.time() - overall_start
+
+    all_latencies = []
+    total_success = 0
+    total_fail = 0
+    for host_name in host_domain_mapping:
+        output, host_time = results[host_name]
+        success_count, latencies = parse_dig_batch(output)
+        fail_count = n_queries[host_name] - success_count
+
+        all_latencies += latencies
+        total_success += success_count
+        total_fail += fail_count
+        throughput = success_count / host_time if host_time > 0 else 0
+        print(f"    {host_name}: {success_count} ok, {fail_count} failed, "
+              f"p50 {percentile(latencies, 50)} ms, {throughput:.2f} queries/sec")
+
+    avg_latency = sum(all_latencies) / len(all_latencies) if all_latencies else 0
+    throughput = total_success / overall_time if overall_time > 0 else 0
+
+    print(f"Aggregate results for {len(procs)} hosts:")
+    print(f"    - Successfully Resolved: {total_success}")
+    print(f"    - Failed Resolutions:    {total_fail}")
+    print(f"    - Average Lookup Latency: {avg_latency:.2f} ms")
+    print(f"    - Latency p50/p90/p99:   {percentile(all_latencies, 50)} / "
+          f"{percentile(all_latencies, 90)} / {percentile(all_latencies, 99)} ms")
+    print(f"    - Total Throughput:      {throughput:.2f} queries/sec")
+
+
 import subprocess
+import threading
 import time
 
 if __name__ == '__main__':
@@ -104,9 +256,15 @@ if __name__ == '__main__':
         'h4': 'PCAP_4_H4_domains',
     }
     
-    topo = AssignmentTopo()
+    if (TOPOLOGY == "SCALABLE"):
+        # reuse the four PCAP domain lists round-robin over all hosts
+        files = list(domain_files.values())
+        domain_files = {f'h{i + 1}': files[i % len(files)] for i in range(NUM_HOSTS)}
+        topo = ScalableTopo()
+    else:
+        topo = AssignmentTopo()
     net = Mininet(topo=topo, link=TCLink, controller=OVSController)
-    nat = net.addNAT()
+    nat = net.addNAT(ip='10.0.0.6') # fixed, socat binds to it and hosts are numbered around it
     nat.configDefault()
 
     print("Starting network...")
@@ -131,12 +289,16 @@ if __name__ == '__main__':
         print("Starting custom DNS resolver on dns node...")
         dns_host.cmd('python3 /home/nimitt/CS3L31-CN-Assignments/A2/resolver.py &')
         time.sleep(3)
-        for h in ['h1', 'h2', 'h3', 'h4']:
+        for h in domain_files:
             host = net.get(h)
             host.cmd('echo "nameserver 10.0.0.5" > /etc/resolv.conf')
 
     CLI(net)
-    dns_analysis(net, domain_files)
+    if (TOPOLOGY == "SCALABLE"):
+        resolver_ip = nat.IP() if DNSRESOLVER == "DEFAULT" else '10.0.0.5'
+        concurrent_dns_analysis(net, domain_files, resolver_ip)
+    else:
+        dns_analysis(net, domain_files)
     
     if proxy_process:
         print(f"\nStopping socat proxy (PID: {proxy_process.pid})...")